@@ -14,11 +14,13 @@
 """A script to process FBI Hate Crime table 5 publications."""
 import os
 import sys
-import tempfile
 import csv
 import json
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from absl import app
 from absl import flags
 
@@ -42,6 +44,26 @@ _YEAR_INDEX = 0
 # Columns in final cleaned CSV
 _OUTPUT_COLUMNS = ('Year', 'StatVar', 'Quantity')
 
+# The props ignored for dcid generation are a function of the statvar's shape,
+# which is fixed by the (column, bias motivation) pair. Cached across years.
+_IGNORE_PROPS_CACHE = {}
+
+# Data columns of the cleaned dataframe, in the order they are written out.
+# The publications changed the offender race breakdown in 2013.
+_DATA_COLUMNS_FROM_2013 = ('total offenses', 'white',
+                           'black or african american',
+                           'american indian or alaska native', 'asian',
+                           'native hawaiian or other pacific islander',
+                           'multiple races', 'unknown race',
+                           'hispanic or latino', 'not hispanic or latino',
+                           'group of multiple ethnicities', 'unknown ethnicity',
+                           'unknown offender')
+_DATA_COLUMNS_BEFORE_2013 = ('total offenses', 'white',
+                             'black or african american',
+                             'american indian or alaska native',
+                             'asian or pacific islander', 'multiple races',
+                             'unknown race', 'unknown offender')
+
 # A config that maps the year to corresponding xls file with args to be used
 # with pandas.read_excel()
 _YEARWISE_CONFIG = {
@@ -52,7 +74,8 @@ _YEARWISE_CONFIG = {
             'header': 6,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2019': {
         'type': 'xls',
@@ -61,7 +84,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2018': {
         'type': 'xls',
@@ -70,7 +94,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2017': {
         'type': 'xls',
@@ -79,7 +104,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2016': {
         'type': 'xls',
@@ -88,7 +114,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2015': {
         'type': 'xls',
@@ -97,7 +124,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 2,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2014': {
         'type': 'xls',
@@ -106,7 +134,8 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 3,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2013': {
         'type': 'xls',
@@ -115,134 +144,157 @@ _YEARWISE_CONFIG = {
             'header': 5,
             'skipfooter': 3,
             'usecols': list(range(0, 14))
-        }
+        },
+        'output_columns': _DATA_COLUMNS_FROM_2013
     },
     '2012': {
         'type': 'xls',
         'path': '../source_data/2012/table_5.xls',
         'args': {
             'header': 5,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2011': {
         'type': 'xls',
         'path': '../source_data/2011/table_5.xls',
         'args': {
             'header': 4,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2010': {
         'type': 'xls',
         'path': '../source_data/2010/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2009': {
         'type': 'xls',
         'path': '../source_data/2009/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2008': {
         'type': 'xls',
         'path': '../source_data/2008/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2007': {
         'type': 'xls',
         'path': '../source_data/2007/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2006': {
         'type': 'xls',
         'path': '../source_data/2006/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2005': {
         'type': 'xls',
         'path': '../source_data/2005/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     },
     '2004': {
         'type': 'xls',
         'path': '../source_data/2004/table_5.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 9))
+        },
+        'output_columns': _DATA_COLUMNS_BEFORE_2013
     }
 }
 
 
-def _write_row(year: int, statvar_dcid: str, quantity: str,
-               writer: csv.DictWriter):
-    """A wrapper to write data to the cleaned CSV."""
-    processed_dict = {
-        'Year': year,
-        'StatVar': statvar_dcid,
-        'Quantity': quantity
-    }
-    writer.writerow(processed_dict)
-
-
-def _write_output_csv(reader: csv.DictReader, writer: csv.DictWriter,
-                      config: dict) -> list:
-    """Reads each row of a CSV and creates statvars for counts of
-    Incidents, Offenses, Victims and Known Offenders with different bias
-    motivations.
+def _write_output_csv(df: pd.DataFrame, data_columns: tuple, writer: csv.writer,
+                      config: dict) -> dict:
+    """Creates statvars for counts of Incidents, Offenses, Victims and Known
+    Offenders with different bias motivations and writes a year's worth of
+    output rows, using pandas columnar operations instead of a per-row loop.
 
     Args:
-        reader: CSV dict reader.
-        writer: CSV dict writer of final cleaned CSV.
+        df: The cleaned dataframe of one year.
+        data_columns: The year's data column names, from _YEARWISE_CONFIG.
+        writer: CSV writer of final cleaned CSV.
         config: A dict which maps constraint props to the statvar based on
           values in the CSV. See scripts/fbi/hate_crime/table2/config.json for
           an example.
 
     Returns:
-        A list of statvars.
+        A dict of statvars keyed by dcid, in first-seen order.
     """
-    statvars = []
-    columns = list(reader.fieldnames)
-    columns.remove('bias motivation')
-    columns.remove('Year')
-    for crime in reader:
-        bias_motivation = crime['bias motivation']
-        bias_motivation_key_value = config['pvs'][bias_motivation]
-
-        statvar_list = []
-        for c in columns:
-            statvar = {**config['populationType'][c]}
-            statvar_list.append(statvar)
+    statvar_map = {}
+    dcid_map = {}  # (data column, bias motivation) -> statvar dcid.
+    pop_type = config['populationType']
+    pvs = config['pvs']
+    # unique() yields the bias motivations in first-seen order, so the
+    # statvar_map (and with it the MCF) keeps the order a per-row scan
+    # would produce.
+    for bias_motivation in df['bias motivation'].unique():
+        bias_motivation_key_value = pvs[bias_motivation]
+        for c in data_columns:
+            statvar = {**pop_type[c], **bias_motivation_key_value}
+            ignore_props = _IGNORE_PROPS_CACHE.get((c, bias_motivation))
+            if ignore_props is None:
+                ignore_props = utils.get_dpv(statvar, config)
+                _IGNORE_PROPS_CACHE[(c, bias_motivation)] = ignore_props
+            dcid = utils.get_cached_statvar_dcid(statvar, ignore_props)
+            statvar['Node'] = dcid
+            dcid_map[(c, bias_motivation)] = dcid
+            statvar_map.setdefault(dcid, statvar)
 
-        utils.update_statvars(statvar_list, bias_motivation_key_value)
-        utils.update_statvar_dcids(statvar_list, config)
-
-        for idx, c in enumerate(columns):
-            if crime[c] != '':
-                _write_row(crime['Year'], statvar_list[idx]['Node'], crime[c],
-                           writer)
-
-        statvars.extend(statvar_list)
-
-    return statvars
+    # Melt the data columns to long form in one C-level pass. Casting them
+    # to object first keeps each cell's original scalar type, so integer
+    # counts do not pick up a '.0' from a float upcast in the csv text.
+    long_df = df.astype({
+        c: object for c in data_columns
+    }).melt(id_vars=['Year', 'bias motivation'],
+            value_vars=list(data_columns),
+            var_name='column',
+            value_name='Quantity')
+    # melt stacks one block per data column; interleave the blocks back
+    # into the row-major order of the source table.
+    order = np.arange(len(long_df)).reshape(len(data_columns), -1).T.ravel()
+    long_df = long_df.take(order)
+    long_df = long_df[long_df['Quantity'].notna()]
+    statvar_col = pd.MultiIndex.from_arrays(
+        [long_df['column'], long_df['bias motivation']]).map(dcid_map.get)
+    writer.writerows(zip(long_df['Year'], statvar_col, long_df['Quantity']))
+    return statvar_map
 
 
 def _clean_dataframe(df: pd.DataFrame, year: str):
@@ -264,39 +316,52 @@ def _clean_dataframe(df: pd.DataFrame, year: str):
             'unknown offender'
         ]
 
-    df['bias motivation'] = df['bias motivation'].replace(r'[\d:]+',
-                                                          '',
-                                                          regex=True)
-    df['bias motivation'] = df['bias motivation'].replace(r'\s+',
-                                                          ' ',
-                                                          regex=True)
-    df['bias motivation'] = df['bias motivation'].str.strip()
+    df['bias motivation'] = df['bias motivation'].str.replace(r'[\d:]+',
+                                                              '',
+                                                              regex=True)
+    # split/join collapses runs of whitespace and strips in one C-level pass.
+    df['bias motivation'] = df['bias motivation'].str.split().str.join(' ')
     return df
 
 
+def _load_year(year: str, config: dict) -> pd.DataFrame:
+    """Reads and cleans the spreadsheet of a single year. Defined at module
+    scope so it can be dispatched to worker processes."""
+    xls_file_path = os.path.join(_SCRIPT_PATH, config['path'])
+
+    read_file = utils.read_excel_calamine(xls_file_path, **config['args'])
+    read_file = _clean_dataframe(read_file, year)
+    read_file.insert(_YEAR_INDEX, 'Year', year)
+    return read_file
+
+
 def main(argv):
-    csv_files = []
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        for year, config in _YEARWISE_CONFIG.items():
-            xls_file_path = os.path.join(_SCRIPT_PATH, config['path'])
-            csv_file_path = os.path.join(tmp_dir, year + '.csv')
+    # The years have no data dependency and the Excel parsing is CPU bound,
+    # so each year is loaded in a separate worker process.
+    df_by_year = {}
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(_load_year, year, config): year
+            for year, config in _YEARWISE_CONFIG.items()
+        }
+        for future in as_completed(futures):
+            df_by_year[futures[future]] = future.result()
 
-            read_file = pd.read_excel(xls_file_path, **config['args'])
-            read_file = _clean_dataframe(read_file, year)
-            read_file.insert(_YEAR_INDEX, 'Year', year)
-            read_file.to_csv(csv_file_path, header=True, index=False)
-            csv_files.append(csv_file_path)
+    # Keep the output deterministic by processing years in config order.
+    dfs = [(df_by_year[year], config['output_columns'])
+           for year, config in _YEARWISE_CONFIG.items()]
 
-        config_path = os.path.join(_SCRIPT_PATH, 'config.json')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+    config_path = os.path.join(_SCRIPT_PATH, 'config.json')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = utils.intern_statvar_config(json.load(f))
 
-        cleaned_csv_path = os.path.join(_FLAGS.output_dir, 'cleaned.csv')
-        statvars = utils.create_csv_mcf(csv_files, cleaned_csv_path, config,
-                                        _OUTPUT_COLUMNS, _write_output_csv)
-        if _FLAGS.gen_statvar_mcf:
-            mcf_path = os.path.join(_FLAGS.output_dir, 'output.mcf')
-            utils.create_mcf(statvars, mcf_path)
+    cleaned_csv_path = os.path.join(_FLAGS.output_dir, 'cleaned.csv')
+    statvar_map = utils.create_csv_mcf_from_dfs(dfs, cleaned_csv_path, config,
+                                                _OUTPUT_COLUMNS,
+                                                _write_output_csv)
+    if _FLAGS.gen_statvar_mcf:
+        mcf_path = os.path.join(_FLAGS.output_dir, 'output.mcf')
+        utils.create_mcf_from_map(statvar_map, mcf_path)
 
 
 if __name__ == '__main__':
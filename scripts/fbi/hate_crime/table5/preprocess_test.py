@@ -18,7 +18,6 @@ import sys
 import unittest
 import tempfile
 import json
-import pandas as pd
 from . import preprocess
 
 _SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -26,15 +25,12 @@ sys.path.append(os.path.join(_SCRIPT_PATH, '..'))  # for utils
 
 import utils
 
-_YEAR_INDEX = 0
-
 _OUTPUT_COLUMNS = ('Year', 'StatVar', 'Quantity')
 
 
 class HateCrimeTable5Test(unittest.TestCase):
 
     def test_csv(self):
-        csv_files = []
         test_config = {
             'type': 'xls',
             'path': 'testdata/2016.xls',
@@ -45,22 +41,17 @@ class HateCrimeTable5Test(unittest.TestCase):
             }
         }
         with tempfile.TemporaryDirectory() as tmp_dir:
-            xls_file_path = os.path.join(_SCRIPT_PATH, test_config['path'])
-            csv_file_path = os.path.join(tmp_dir, '2016.csv')
-
-            read_file = pd.read_excel(xls_file_path, **test_config['args'])
-            read_file = preprocess._clean_dataframe(read_file, '2016')
-            read_file.insert(_YEAR_INDEX, 'Year', '2016')
-            read_file.to_csv(csv_file_path, header=True, index=False)
-            csv_files.append(csv_file_path)
+            dfs = [(preprocess._load_year('2016', test_config),
+                    preprocess._DATA_COLUMNS_FROM_2013)]
 
             config_path = os.path.join(_SCRIPT_PATH, 'config.json')
             with open(config_path, 'r', encoding='utf-8') as f:
                 config = json.load(f)
 
             cleaned_csv_path = os.path.join(tmp_dir, 'cleaned.csv')
-            utils.create_csv_mcf(csv_files, cleaned_csv_path, config,
-                                 _OUTPUT_COLUMNS, preprocess._write_output_csv)
+            utils.create_csv_mcf_from_dfs(dfs, cleaned_csv_path, config,
+                                          _OUTPUT_COLUMNS,
+                                          preprocess._write_output_csv)
 
             with open(cleaned_csv_path, 'r', encoding='utf-8') as f_result:
                 test_result = f_result.read()
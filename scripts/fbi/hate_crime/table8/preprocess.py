@@ -14,11 +14,13 @@
 """A script to process FBI Hate Crime table 8 publications."""
 import os
 import sys
-import tempfile
 import csv
 import json
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from absl import app
 from absl import flags
 
@@ -42,6 +44,10 @@ _YEAR_INDEX = 0
 # Columns in final cleaned CSV
 _OUTPUT_COLUMNS = ('Year', 'StatVar', 'Quantity')
 
+# Data columns of the cleaned dataframe, in the order they are written out
+_DATA_COLUMNS = ('total incidents', 'individual', 'business', 'government',
+                 'religious organization', 'society', 'other/unknown/multiple')
+
 # A config that maps the year to corresponding xls file with args to be used
 # with pandas.read_excel()
 _YEARWISE_CONFIG = {
@@ -50,206 +56,227 @@ _YEARWISE_CONFIG = {
         'path': '../source_data/2020/table_8.xlsx',
         'args': {
             'header': 6,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2019': {
         'type': 'xls',
         'path': '../source_data/2019/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2018': {
         'type': 'xls',
         'path': '../source_data/2018/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2017': {
         'type': 'xls',
         'path': '../source_data/2017/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2016': {
         'type': 'xls',
         'path': '../source_data/2016/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2015': {
         'type': 'xls',
         'path': '../source_data/2015/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2014': {
         'type': 'xls',
         'path': '../source_data/2014/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2013': {
         'type': 'xls',
         'path': '../source_data/2013/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2012': {
         'type': 'xls',
         'path': '../source_data/2012/table_8.xls',
         'args': {
             'header': 5,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2011': {
         'type': 'xls',
         'path': '../source_data/2011/table_8.xls',
         'args': {
             'header': 4,
-            'skipfooter': 4
-        }
+            'skipfooter': 4,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2010': {
         'type': 'xls',
         'path': '../source_data/2010/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2009': {
         'type': 'xls',
         'path': '../source_data/2009/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2008': {
         'type': 'xls',
         'path': '../source_data/2008/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2007': {
         'type': 'xls',
         'path': '../source_data/2007/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2006': {
         'type': 'xls',
         'path': '../source_data/2006/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2005': {
         'type': 'xls',
         'path': '../source_data/2005/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 2
-        }
+            'skipfooter': 2,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     },
     '2004': {
         'type': 'xls',
         'path': '../source_data/2004/table_8.xls',
         'args': {
             'header': 3,
-            'skipfooter': 1
-        }
+            'skipfooter': 1,
+            'usecols': list(range(0, 8))
+        },
+        'output_columns': _DATA_COLUMNS
     }
 }
 
 
-def _write_row(year: int, statvar_dcid: str, quantity: str,
-               writer: csv.DictWriter):
-    """A wrapper to write data to the cleaned CSV."""
-    processed_dict = {
-        'Year': year,
-        'StatVar': statvar_dcid,
-        'Quantity': quantity
-    }
-    writer.writerow(processed_dict)
-
-
-def _write_output_csv(reader: csv.DictReader, writer: csv.DictWriter,
-                      config: dict) -> list:
-    """Reads each row of a CSV and creates statvars for counts of
-    Incidents, Offenses, Victims and Known Offenders with different bias
-    motivations.
+def _write_output_csv(df: pd.DataFrame, data_columns: tuple, writer: csv.writer,
+                      config: dict) -> dict:
+    """Creates statvars for counts of Incidents, Offenses, Victims and Known
+    Offenders with different bias motivations and writes a year's worth of
+    output rows, using pandas columnar operations instead of a per-row loop.
 
     Args:
-        reader: CSV dict reader.
-        writer: CSV dict writer of final cleaned CSV.
+        df: The cleaned dataframe of one year.
+        data_columns: The year's data column names, from _YEARWISE_CONFIG.
+        writer: CSV writer of final cleaned CSV.
         config: A dict which maps constraint props to the statvar based on
           values in the CSV. See scripts/fbi/hate_crime/table2/config.json for
           an example.
 
     Returns:
-        A list of statvars.
+        A dict of statvars keyed by dcid, in first-seen order.
     """
-    statvars = []
-    for crime in reader:
-        bias_motivation = crime['bias motivation']
-        bias_motivation_key_value = config['pvs'][bias_motivation]
-
-        total_incident_statvar = {**config['populationType']['total incidents']}
-        individual_statvar = {**config['populationType']['individual']}
-        business_statvar = {**config['populationType']['business']}
-        government_statvar = {**config['populationType']['government']}
-        rel_org_statvar = {**config['populationType']['religious organization']}
-        society_statvar = {**config['populationType']['society']}
-        other_statvar = {**config['populationType']['other/unknown/multiple']}
-
-        statvar_list = [
-            total_incident_statvar, individual_statvar, business_statvar,
-            government_statvar, rel_org_statvar, society_statvar, other_statvar
-        ]
+    statvar_map = {}
+    dcid_map = {}  # (data column, bias motivation) -> statvar dcid.
+    pop_type = config['populationType']
+    pvs = config['pvs']
+    # unique() yields the bias motivations in first-seen order, so the
+    # statvar_map (and with it the MCF) keeps the order a per-row scan
+    # would produce.
+    for bias_motivation in df['bias motivation'].unique():
+        bias_motivation_key_value = pvs[bias_motivation]
+        for c in data_columns:
+            statvar = {**pop_type[c], **bias_motivation_key_value}
+            dcid = utils.get_cached_statvar_dcid(statvar,
+                                                 utils.get_dpv(statvar, config))
+            statvar['Node'] = dcid
+            dcid_map[(c, bias_motivation)] = dcid
+            statvar_map.setdefault(dcid, statvar)
 
-        utils.update_statvars(statvar_list, bias_motivation_key_value)
-        utils.update_statvar_dcids(statvar_list, config)
-
-        _write_row(crime['Year'], total_incident_statvar['Node'],
-                   crime['total incidents'], writer)
-        _write_row(crime['Year'], individual_statvar['Node'],
-                   crime['individual'], writer)
-        _write_row(crime['Year'], business_statvar['Node'], crime['business'],
-                   writer)
-        _write_row(crime['Year'], government_statvar['Node'],
-                   crime['government'], writer)
-        _write_row(crime['Year'], rel_org_statvar['Node'],
-                   crime['religious organization'], writer)
-        _write_row(crime['Year'], society_statvar['Node'], crime['society'],
-                   writer)
-        _write_row(crime['Year'], other_statvar['Node'],
-                   crime['other/unknown/multiple'], writer)
-
-        statvars.extend(statvar_list)
-
-    return statvars
+    # Melt the data columns to long form in one C-level pass. Casting them
+    # to object first keeps each cell's original scalar type, so integer
+    # counts do not pick up a '.0' from a float upcast in the csv text.
+    long_df = df.astype({
+        c: object for c in data_columns
+    }).melt(id_vars=['Year', 'bias motivation'],
+            value_vars=list(data_columns),
+            var_name='column',
+            value_name='Quantity')
+    # melt stacks one block per data column; interleave the blocks back
+    # into the row-major order of the source table.
+    order = np.arange(len(long_df)).reshape(len(data_columns), -1).T.ravel()
+    long_df = long_df.take(order)
+    # Empty cells stay in the output as empty Quantity values.
+    long_df['Quantity'] = long_df['Quantity'].fillna('')
+    statvar_col = pd.MultiIndex.from_arrays(
+        [long_df['column'], long_df['bias motivation']]).map(dcid_map.get)
+    writer.writerows(zip(long_df['Year'], statvar_col, long_df['Quantity']))
+    return statvar_map
 
 
 def _clean_dataframe(df: pd.DataFrame, year: str):
@@ -259,43 +286,53 @@ def _clean_dataframe(df: pd.DataFrame, year: str):
         'government', 'religious organization', 'society',
         'other/unknown/multiple'
     ]
-    df['bias motivation'] = df['bias motivation'].replace(r'[\d:]+',
-                                                          '',
-                                                          regex=True)
-    df['bias motivation'] = df['bias motivation'].replace(r'\s+',
-                                                          ' ',
-                                                          regex=True)
-    df['bias motivation'] = df['bias motivation'].str.strip()
+    df['bias motivation'] = df['bias motivation'].str.replace(r'[\d:]+',
+                                                              '',
+                                                              regex=True)
+    # split/join collapses runs of whitespace and strips in one C-level pass.
+    df['bias motivation'] = df['bias motivation'].str.split().str.join(' ')
 
     return df
 
 
+def _load_year(year: str, config: dict) -> pd.DataFrame:
+    """Reads and cleans the spreadsheet of a single year. Defined at module
+    scope so it can be dispatched to worker processes."""
+    xls_file_path = os.path.join(_SCRIPT_PATH, config['path'])
+
+    read_file = utils.read_excel_calamine(xls_file_path, **config['args'])
+    read_file = _clean_dataframe(read_file, year)
+    read_file.insert(_YEAR_INDEX, 'Year', year)
+    return read_file
+
+
 def main(argv):
-    csv_files = []
-    tmp_dir = '.'
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        for year, config in _YEARWISE_CONFIG.items():
-            xls_file_path = os.path.join(_SCRIPT_PATH, config['path'])
-            csv_file_path = os.path.join(tmp_dir, year + '.csv')
+    # The years have no data dependency and the Excel parsing is CPU bound,
+    # so each year is loaded in a separate worker process.
+    df_by_year = {}
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(_load_year, year, config): year
+            for year, config in _YEARWISE_CONFIG.items()
+        }
+        for future in as_completed(futures):
+            df_by_year[futures[future]] = future.result()
 
-            read_file = pd.read_excel(xls_file_path,
-                                      **config['args'],
-                                      usecols=[0, 1, 2, 3, 4, 5, 6, 7])
-            read_file = _clean_dataframe(read_file, year)
-            read_file.insert(_YEAR_INDEX, 'Year', year)
-            read_file.to_csv(csv_file_path, header=True, index=False)
-            csv_files.append(csv_file_path)
+    # Keep the output deterministic by processing years in config order.
+    dfs = [(df_by_year[year], config['output_columns'])
+           for year, config in _YEARWISE_CONFIG.items()]
 
-        config_path = os.path.join(_SCRIPT_PATH, 'config.json')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+    config_path = os.path.join(_SCRIPT_PATH, 'config.json')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = utils.intern_statvar_config(json.load(f))
 
-        cleaned_csv_path = os.path.join(_FLAGS.output_dir, 'cleaned.csv')
-        statvars = utils.create_csv_mcf(csv_files, cleaned_csv_path, config,
-                                        _OUTPUT_COLUMNS, _write_output_csv)
-        if _FLAGS.gen_statvar_mcf:
-            mcf_path = os.path.join(_FLAGS.output_dir, 'output.mcf')
-            utils.create_mcf(statvars, mcf_path)
+    cleaned_csv_path = os.path.join(_FLAGS.output_dir, 'cleaned.csv')
+    statvar_map = utils.create_csv_mcf_from_dfs(dfs, cleaned_csv_path, config,
+                                                _OUTPUT_COLUMNS,
+                                                _write_output_csv)
+    if _FLAGS.gen_statvar_mcf:
+        mcf_path = os.path.join(_FLAGS.output_dir, 'output.mcf')
+        utils.create_mcf_from_map(statvar_map, mcf_path)
 
 
 if __name__ == '__main__':
@@ -17,6 +17,8 @@ import sys
 import csv
 import pandas as pd
 
+from python_calamine import get_sheet_data
+
 from geo_id_resolver import convert_to_place_dcid
 
 # Allows the following module imports to work when running as a script
@@ -26,6 +28,73 @@ sys.path.append(os.path.join(_SCRIPT_PATH,
 
 from statvar_dcid_generator import get_statvar_dcid
 
+# Cache of generated statvar dcids keyed by the statvar's property:values and
+# the ignored props. The tables have a small, fixed set of statvar shapes
+# (columns x bias motivations), so dcids repeat across rows and years.
+_DCID_CACHE = {}
+
+
+def get_cached_statvar_dcid(statvar: dict, ignore_props: list = None) -> str:
+    """A memoized wrapper around get_statvar_dcid().
+
+    Args:
+        statvar: A dictionary of prop:values of the statvar.
+        ignore_props: A list of properties to ignore when generating the dcid.
+
+    Returns:
+        The dcid of the statvar.
+    """
+    if ignore_props is None:
+        ignore_props = []
+    key = (frozenset(statvar.items()), tuple(sorted(ignore_props)))
+    dcid = _DCID_CACHE.get(key)
+    if dcid is None:
+        dcid = get_statvar_dcid(statvar, ignore_props=ignore_props)
+        _DCID_CACHE[key] = dcid
+    return dcid
+
+
+def read_excel_calamine(xls_file_path: str,
+                        header: int = 0,
+                        skipfooter: int = 0,
+                        usecols: list = None) -> pd.DataFrame:
+    """Reads the first sheet of an Excel file into a dataframe using the
+    Rust-backed calamine parser.
+
+    Mirrors the pandas.read_excel arguments the hate crime table configs use
+    without needing pandas' own calamine engine, which arrived in pandas 2.2
+    and is beyond the repo's pin.
+
+    Args:
+        xls_file_path: Path of the .xls/.xlsx file to read.
+        header: 0-based index of the header row; data starts after it.
+        skipfooter: Number of trailing footer rows to drop.
+        usecols: Column positions to keep.
+
+    Returns:
+        A dataframe of the data rows, with positional column labels.
+    """
+    rows = get_sheet_data(xls_file_path, 0)
+    data_rows = rows[header + 1:len(rows) - skipfooter]
+    if usecols is None:
+        usecols = range(max((len(row) for row in data_rows), default=0))
+    data = []
+    for row in data_rows:
+        values = []
+        for i in usecols:
+            value = row[i] if i < len(row) else None
+            if value == '':
+                # Empty cells become NaN so pandas coerces their columns to
+                # floats, like read_excel does.
+                value = None
+            elif isinstance(value, float) and value.is_integer():
+                # read_excel turns whole floats back into ints
+                # (convert_float), keeping the count columns integral.
+                value = int(value)
+            values.append(value)
+        data.append(values)
+    return pd.DataFrame(data)
+
 
 def create_csv_mcf(csv_files: list, cleaned_csv_path: str, config: dict,
                    output_cols: list, write_output_csv) -> list:
@@ -55,6 +124,59 @@ def create_csv_mcf(csv_files: list, cleaned_csv_path: str, config: dict,
     return statvars
 
 
+def create_csv_mcf_from_dfs(dfs: list, cleaned_csv_path: str, config: dict,
+                            output_cols: list, write_output_csv) -> dict:
+    """Creates StatVars according to the in-memory cleaned dataframes of each
+    year and writes the final output to a csv.
+
+    Unlike create_csv_mcf(), this skips the intermediate CSV serialization and
+    operates directly on the cleaned dataframes.
+
+    Args:
+        dfs: A list of (dataframe, data column names) tuples, one per year.
+        cleaned_csv_path: Path of the final cleaned CSV file.
+        config: A dict which maps constraint props to the statvar based on
+          values in the CSV. See scripts/fbi/hate_crime/table2/config.json for
+          an example.
+
+    Returns:
+        A dict of statvars keyed by dcid, in first-seen order.
+    """
+    statvar_map = {}
+    # The large buffer batches the many small csv rows into few syscalls.
+    with open(cleaned_csv_path,
+              'w',
+              encoding='utf-8',
+              newline='',
+              buffering=1 << 20) as output_f:
+        # A plain csv.writer with tuple rows skips the per-row fieldname
+        # lookups a DictWriter would do.
+        writer = csv.writer(output_f)
+        writer.writerow(output_cols)
+
+        for df, data_columns in dfs:
+            statvar_map.update(
+                write_output_csv(df, data_columns, writer, config))
+    return statvar_map
+
+
+def intern_statvar_config(config: dict) -> dict:
+    """Interns the string keys and values of the 'pvs' and 'populationType'
+    sections of a statvar config.
+
+    The tables repeat the same few bias motivations and statvar properties on
+    every row, so interning lets dict lookups and the dcid cache key hashing
+    hit the pointer-comparison fast path.
+    """
+    for section in ('pvs', 'populationType'):
+        config[section] = {
+            sys.intern(key): {
+                sys.intern(p): sys.intern(v) for p, v in pvs.items()
+            } for key, pvs in config[section].items()
+        }
+    return config
+
+
 def update_statvars(statvar_list: list, key_value: dict):
     """Given a list of statvars and a key:value pair, this functions adds the
     key value pair to each statvar.
@@ -89,18 +211,32 @@ def get_dpv(statvar: dict, config: dict) -> list:
 def create_mcf(stat_vars: list, mcf_file_path: str):
     """Writes all statvars to a .mcf file."""
     dcid_set = set()
-    with open(mcf_file_path, 'w', encoding='utf-8') as f:
-        for sv in stat_vars:
-            dcid = sv['Node']
-            if dcid in dcid_set:
-                continue
-            dcid_set.add(dcid)
-            statvar_mcf_list = [f'Node: dcid:{dcid}']
-            for p, v in sv.items():
-                if p != 'Node':
-                    statvar_mcf_list.append(f'{p}: dcs:{v}')
-            statvar_mcf = '\n'.join(statvar_mcf_list) + '\n\n'
-            f.write(statvar_mcf)
+    parts = []
+    for sv in stat_vars:
+        dcid = sv['Node']
+        if dcid in dcid_set:
+            continue
+        dcid_set.add(dcid)
+        parts.append(f'Node: dcid:{dcid}\n' + '\n'.join(
+            f'{p}: dcs:{v}' for p, v in sv.items() if p != 'Node'))
+    # A single buffered binary write skips the text-mode codec machinery.
+    with open(mcf_file_path, 'wb', buffering=1 << 20) as f:
+        f.write(('\n\n'.join(parts) + '\n\n').encode('utf-8'))
+
+
+def create_mcf_from_map(statvar_map: dict, mcf_file_path: str):
+    """Writes a dict of statvars keyed by dcid to a .mcf file.
+
+    Unlike create_mcf(), the statvars are already unique, so no dedup pass
+    is needed.
+    """
+    parts = []
+    for dcid, sv in statvar_map.items():
+        parts.append(f'Node: dcid:{dcid}\n' + '\n'.join(
+            f'{p}: dcs:{v}' for p, v in sv.items() if p != 'Node'))
+    # A single buffered binary write skips the text-mode codec machinery.
+    with open(mcf_file_path, 'wb', buffering=1 << 20) as f:
+        f.write(('\n\n'.join(parts) + '\n\n').encode('utf-8'))
 
 
 def update_statvar_dcids(statvar_list: list, config: dict):
@@ -109,8 +245,7 @@ def update_statvar_dcids(statvar_list: list, config: dict):
     """
     for d in statvar_list:
         ignore_props = get_dpv(d, config)
-        dcid = get_statvar_dcid(d, ignore_props=ignore_props)
-        d['Node'] = dcid
+        d['Node'] = get_cached_statvar_dcid(d, ignore_props=ignore_props)
 
 
 def agg_hate_crime_df(df: pd.DataFrame,